@@ -1,54 +1,240 @@
-from flask import Flask, render_template, request, jsonify
-import ollama
-from langchain.agents import initialize_agent, Tool, AgentType
-from langchain.llms import Ollama
-from langchain.agents.agent import AgentOutputParser
-from langchain.schema import AgentAction, AgentFinish
-import wikipedia
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from langchain.agents import AgentExecutor, Tool, ZeroShotAgent
+from langchain.agents.mrkl.output_parser import FINAL_ANSWER_ACTION
+from langchain.chains import LLMChain
+from langchain.prompts import PromptTemplate
+from langchain.callbacks.streaming_aiter_final_only import AsyncFinalIteratorCallbackHandler
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel
 from duckduckgo_search import DDGS
-import requests
-from typing import Optional, Dict, Any, List
-import xml.etree.ElementTree as ET
-import json
-from typing import Union
+import httpx
+import asyncio
+from typing import Optional, Dict, List, Tuple
+from lxml import etree
+import io
+from urllib.parse import quote
+import orjson
 import re
+import os
+import functools
+import contextlib
+import ast
+import operator
+from cachetools import TTLCache
 
-app = Flask(__name__)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# Initialize Llama model using Ollama
-llama = Ollama(model="llama3.1")
+# Shared HTTP/2 client so concurrent calls to Wikipedia, arXiv and PubMed
+# multiplex over reused connections instead of paying a new TCP+TLS handshake
+# on every call. It is opened in each worker's lifespan so no sockets are
+# shared across uvicorn worker processes.
+# HTTP/2 support needs the ``h2`` package, installed by ``httpx[http2]`` in
+# requirements.txt.
+HTTP_CLIENT: Optional[httpx.AsyncClient] = None
 
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    global HTTP_CLIENT
+    HTTP_CLIENT = httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+        ),
+        headers={"User-Agent": "IntelliAgent-Hub/1.0 (research assistant)"},
+        timeout=10,
+    )
+    try:
+        yield
+    finally:
+        await HTTP_CLIENT.aclose()
+
+app = FastAPI(lifespan=lifespan)
+app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
+templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
+
+# Initialize Llama model served by vLLM through its OpenAI-compatible API.
+# Start the server from the FP8 (W8A8) checkpoint with prefix caching so the
+# static agent prompt is only prefilled once, and a 1B draft model for
+# speculative decoding (see README):
+#   python -m vllm.entrypoints.openai.api_server \
+#       --model ./llama3.1-8b-fp8 --kv-cache-dtype fp8_e5m2 \
+#       --served-model-name llama-3.1-8b-instruct \
+#       --max-num-seqs 64 --enable-prefix-caching --block-size 16 \
+#       --speculative-config '{"model": "meta-llama/Llama-3.2-1B-Instruct", "num_speculative_tokens": 5}'
+VLLM_BASE_URL = os.environ.get("VLLM_BASE_URL", "http://localhost:8000/v1")
+VLLM_MODEL = os.environ.get("VLLM_MODEL", "llama-3.1-8b-instruct")
+
+# Queries are routed into length bins so short answers are not batched behind
+# long generations. Each bin caps max_tokens and can point at its own vLLM
+# endpoint (VLLM_BASE_URL_SHORT / _LONG), tuned with its own
+# --max-num-batched-tokens; by default all bins share VLLM_BASE_URL.
+# Bare arithmetic never reaches the LLM (see is_math_query), so there is no
+# math bin.
+LLM_BINS = {
+    "short": 256,
+    "long": 512,
+}
+
+# Every agent step is generated with at most this many tokens; a Final Answer
+# that hits the cap is continued with the rest of the bin's budget (see
+# ResearchAgent). Tight caps let vLLM admit more concurrent sequences into its
+# KV cache.
+LLM_STEP_MAX_TOKENS = 256
+
+def make_llm(bin_name: str, max_tokens: int) -> ChatOpenAI:
+    return ChatOpenAI(
+        base_url=os.environ.get(f"VLLM_BASE_URL_{bin_name.upper()}", VLLM_BASE_URL),
+        model=VLLM_MODEL,
+        api_key=os.environ.get("VLLM_API_KEY", "EMPTY"),
+        temperature=0,
+        max_tokens=max_tokens,
+        streaming=True,
+    )
+
+MATH_QUERY_RE = re.compile(r"^[0-9+\-*/(). ]+$")
+LONG_QUERY_RE = re.compile(
+    r"\b(summar\w*|explain\w*|describe|overview|compare|review|history|papers?|research\w*|studies|study)\b",
+    re.IGNORECASE,
+)
+
+def classify_query(query: str) -> str:
+    """Pick the LLM_BINS entry for a query with a cheap keyword heuristic"""
+    query = query.strip()
+    if LONG_QUERY_RE.search(query) or len(query.split()) > 20:
+        return "long"
+    return "short"
+
+def is_math_query(query: str) -> bool:
+    """True for bare arithmetic like '12*34' that BasicMath can answer without the LLM"""
+    query = query.strip()
+    return bool(MATH_QUERY_RE.match(query)) and any(op in query for op in "+-*/")
+
+def normalize_query(query: str) -> str:
+    """Strip the quotes the agent wraps around Action Input and undo '+' word joins"""
+    return query.strip().strip('"\'').replace('+', ' ')
+
+
+class ToolError(str):
+    """Error message returned by a tool; never cached by the Coalescer"""
+
+
+class Coalescer:
+    """Fold concurrent identical tool calls into a single upstream fetch.
+
+    Calls are keyed by the normalized query. While a fetch is in flight, other
+    callers with the same key await its result instead of issuing their own
+    request, and successful results are kept in a TTL cache so repeated
+    queries (e.g. retried ReAct actions) skip the network entirely. The fetch
+    runs in a task owned by the coalescer, so cancelling one caller never
+    cancels the lookup for the others.
+    """
+
+    def __init__(self, fn, cache: TTLCache):
+        functools.update_wrapper(self, fn)
+        self.fn = fn
+        self.cache = cache
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def __call__(self, query: str) -> str:
+        key = normalize_query(query).lower()
 
-def safe_wikipedia_search(query: str) -> str:
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, query))
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._fetch_done, key))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, query: str) -> str:
+        result = await self.fn(query)
+        if not isinstance(result, ToolError):
+            self.cache[key] = result
+        return result
+
+    def _fetch_done(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # mark retrieved when every caller has gone away
+
+
+def coalesced(cache: TTLCache):
+    """Decorate an async tool with a Coalescer backed by ``cache``"""
+    return lambda fn: Coalescer(fn, cache)
+
+
+# Tool response caches are per worker process.
+wiki_cache = TTLCache(maxsize=2048, ttl=600)
+duckduckgo_cache = TTLCache(maxsize=2048, ttl=600)
+arxiv_cache = TTLCache(maxsize=2048, ttl=600)
+pubmed_cache = TTLCache(maxsize=2048, ttl=600)
+
+
+WIKIPEDIA_SUMMARY_URL = 'https://en.wikipedia.org/api/rest_v1/page/summary/'
+WIKIPEDIA_API_URL = 'https://en.wikipedia.org/w/api.php'
+
+async def _wikipedia_summary(title: str) -> httpx.Response:
+    url = WIKIPEDIA_SUMMARY_URL + quote(title.replace(' ', '_'), safe='')
+    return await HTTP_CLIENT.get(url, follow_redirects=True, timeout=5)
+
+async def _wikipedia_opensearch(query: str, limit: int) -> List[str]:
+    response = await HTTP_CLIENT.get(WIKIPEDIA_API_URL, params={
+        'action': 'opensearch', 'search': query, 'limit': limit, 'namespace': 0, 'format': 'json',
+    }, timeout=5)
+    response.raise_for_status()
+    return orjson.loads(response.content)[1]
+
+@coalesced(wiki_cache)
+async def safe_wikipedia_search(query: str) -> str:
     """Safely search Wikipedia with error handling"""
     try:
-        query = query.strip('"\'').replace('+', ' ')
-        search_results = wikipedia.search(query, results=1)
-        if not search_results:
-            return f"No Wikipedia articles found for '{query}'"
-        
-        page_title = search_results[0]
-        page = wikipedia.page(page_title, auto_suggest=False)
-        return page.summary[0:500]
+        query = normalize_query(query)
+        response = await _wikipedia_summary(query)
+        if response.status_code == 404:
+            # Not an exact title: fall back to the closest match from opensearch
+            titles = await _wikipedia_opensearch(query, limit=1)
+            if not titles:
+                return f"No Wikipedia articles found for '{query}'"
+            response = await _wikipedia_summary(titles[0])
+            if response.status_code == 404:
+                return f"No Wikipedia article found for '{query}'"
+        response.raise_for_status()
         
-    except wikipedia.exceptions.DisambiguationError as e:
-        try:
-            page = wikipedia.page(e.options[0], auto_suggest=False)
-            return page.summary[0:500]
-        except:
+        data = orjson.loads(response.content)
+        if data.get('type') == 'disambiguation':
+            # Follow the first concrete article among the other matches
+            for title in await _wikipedia_opensearch(query, limit=5):
+                if title == data.get('title'):
+                    continue
+                response = await _wikipedia_summary(title)
+                if response.status_code != 200:
+                    continue
+                candidate = orjson.loads(response.content)
+                if candidate.get('type') != 'disambiguation':
+                    return candidate.get('extract', '')[0:500]
             return f"Multiple Wikipedia articles found for '{query}'. Please be more specific."
-    except wikipedia.exceptions.PageError:
-        return f"No Wikipedia article found for '{query}'"
+        return data.get('extract', '')[0:500]
     except Exception as e:
-        return f"An error occurred while searching Wikipedia: {str(e)}"
+        return ToolError(f"An error occurred while searching Wikipedia: {str(e)}")
+
+def _duckduckgo_text(query: str) -> list:
+    with DDGS() as ddgs:
+        return list(ddgs.text(query, max_results=3))
 
-def safe_duckduckgo_search(query: str) -> str:
+@coalesced(duckduckgo_cache)
+async def safe_duckduckgo_search(query: str) -> str:
     """Safely search DuckDuckGo with error handling"""
     try:
-        query = query.strip('"\'').replace('+', ' ')
+        query = normalize_query(query)
         
-        with DDGS() as ddgs:
-            results = list(ddgs.text(query, max_results=3))
+        results = await asyncio.to_thread(_duckduckgo_text, query)
         
         if not results:
             return "No results found on DuckDuckGo."
@@ -61,7 +247,31 @@ def safe_duckduckgo_search(query: str) -> str:
         
         return "\n\n".join(formatted_results)
     except Exception as e:
-        return f"An error occurred while searching DuckDuckGo: {str(e)}"
+        return ToolError(f"An error occurred while searching DuckDuckGo: {str(e)}")
+
+SAFE_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+@functools.lru_cache(maxsize=512)
+def _parse_math(expression: str) -> ast.expr:
+    return ast.parse(expression, mode='eval').body
+
+def _eval_math_node(node: ast.expr):
+    """Evaluate a parsed arithmetic expression, rejecting anything but numbers and SAFE_OPS"""
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in SAFE_OPS:
+        return SAFE_OPS[type(node.op)](_eval_math_node(node.left), _eval_math_node(node.right))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in SAFE_OPS:
+        return SAFE_OPS[type(node.op)](_eval_math_node(node.operand))
+    raise ValueError(f"unsupported element '{type(getattr(node, 'op', node)).__name__}'")
 
 def safe_math_eval(expression: str) -> str:
     """Safely evaluate mathematical expressions"""
@@ -69,42 +279,58 @@ def safe_math_eval(expression: str) -> str:
         allowed_chars = set("0123456789+-*/(). ")
         if not all(c in allowed_chars for c in expression):
             return "Invalid mathematical expression. Only basic operations are allowed."
-        result = eval(expression)
+        result = _eval_math_node(_parse_math(expression.strip()))
         return str(result)
     except Exception as e:
         return f"Error evaluating mathematical expression: {str(e)}"
 
-def search_arxiv(query: str) -> str:
+def math_fast_path(query: str) -> Optional[str]:
+    """Answer bare arithmetic without the LLM; None sends the query to the agent instead"""
+    if not is_math_query(query):
+        return None
+    try:
+        return str(_eval_math_node(_parse_math(query.strip())))
+    except Exception:
+        return None
+
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+
+@coalesced(arxiv_cache)
+async def search_arxiv(query: str) -> str:
     """Search ARXiv with improved response parsing"""
+    query = normalize_query(query)
     if not query:
         return "No query provided."
     try:
-        url = f"http://export.arxiv.org/api/query?search_query=all:{query}&start=0&max_results=3"
-        response = requests.get(url, timeout=10)
+        url = f"https://export.arxiv.org/api/query?search_query=all:{query}&start=0&max_results=3"
+        response = await HTTP_CLIENT.get(url)
         response.raise_for_status()
         
-        root = ET.fromstring(response.text)
         results = []
-        for entry in root.findall('{http://www.w3.org/2005/Atom}entry'):
-            title = entry.find('{http://www.w3.org/2005/Atom}title').text
-            summary = entry.find('{http://www.w3.org/2005/Atom}summary').text
-            link = entry.find('{http://www.w3.org/2005/Atom}id').text
+        entries = etree.iterparse(io.BytesIO(response.content), events=('end',), tag=f'{ATOM_NS}entry')
+        for _, entry in entries:
+            title = entry.findtext(f'{ATOM_NS}title')
+            summary = entry.findtext(f'{ATOM_NS}summary', default='')
+            link = entry.findtext(f'{ATOM_NS}id')
             results.append(f"Title: {title}\nLink: {link}\nSummary: {summary[:200]}...\n")
+            entry.clear()
         
         return "\n".join(results) if results else "No results found on arXiv."
     except Exception as e:
-        return f"Error searching ArXiv: {str(e)}"
+        return ToolError(f"Error searching ArXiv: {str(e)}")
 
-def search_pubmed(query: str) -> str:
+@coalesced(pubmed_cache)
+async def search_pubmed(query: str) -> str:
     """Search PubMed with improved response handling"""
+    query = normalize_query(query)
     if not query:
         return "No query provided."
     try:
         esearch_url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pubmed&term={query}&retmax=3&format=json"
-        response = requests.get(esearch_url, timeout=10)
+        response = await HTTP_CLIENT.get(esearch_url)
         response.raise_for_status()
         
-        data = response.json()
+        data = orjson.loads(response.content)
         ids = data.get('esearchresult', {}).get('idlist', [])
         
         if not ids:
@@ -112,10 +338,10 @@ def search_pubmed(query: str) -> str:
             
         ids_string = ",".join(ids)
         esummary_url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=pubmed&id={ids_string}&format=json"
-        response = requests.get(esummary_url, timeout=10)
+        response = await HTTP_CLIENT.get(esummary_url)
         response.raise_for_status()
         
-        data = response.json()
+        data = orjson.loads(response.content)
         results = []
         for id in ids:
             paper = data['result'][id]
@@ -125,18 +351,39 @@ def search_pubmed(query: str) -> str:
             
         return "\n".join(results)
     except Exception as e:
-        return f"Error searching PubMed: {str(e)}"
+        return ToolError(f"Error searching PubMed: {str(e)}")
+
+TOOL_MAP = {
+    "Wikipedia": safe_wikipedia_search,
+    "DuckDuckGo": safe_duckduckgo_search,
+    "ArXiv": search_arxiv,
+    "PubMed": search_pubmed,
+}
+
+async def run_tools(specs: List[Tuple[str, str]]) -> List[str]:
+    """Run several (tool name, query) lookups concurrently"""
+    return await asyncio.gather(*[TOOL_MAP[name](query) for name, query in specs])
+
+async def search_papers(query: str) -> str:
+    """Search arXiv and PubMed concurrently in a single agent step"""
+    query = normalize_query(query)
+    if not query:
+        return "No query provided."
+    arxiv_results, pubmed_results = await run_tools([("ArXiv", query), ("PubMed", query)])
+    return f"ArXiv:\n{arxiv_results}\n\nPubMed:\n{pubmed_results}"
 
 # Define the tools
 tools = [
     Tool(
         name="Wikipedia",
-        func=safe_wikipedia_search,
+        func=None,
+        coroutine=safe_wikipedia_search,
         description="Get detailed explanations and summaries from Wikipedia. who, what, when, where, why, how, story.",
     ),
     Tool(
         name="DuckDuckGo",
-        func=safe_duckduckgo_search,
+        func=None,
+        coroutine=safe_duckduckgo_search,
         description="Search the web for current information. Input: search query. who, what, when, where, why, how.",
     ),
     Tool(
@@ -146,14 +393,22 @@ tools = [
     ),
     Tool(
         name="ArXiv",
-        func=search_arxiv,
+        func=None,
+        coroutine=search_arxiv,
         description="Searches arXiv for scientific papers. research paper topic or keywords.",
     ),
     Tool(
         name="PubMed",
-        func=search_pubmed,
+        func=None,
+        coroutine=search_pubmed,
         description="Searches PubMed for medical research. research paper on medical topic or keywords.",
     ),
+    Tool(
+        name="ResearchPapers",
+        func=None,
+        coroutine=search_papers,
+        description="Searches arXiv and PubMed at the same time. research paper topic or keywords.",
+    ),
 ]
 
 tool_descriptions = "\n".join([f"{tool.name}: {tool.description}" for tool in tools])
@@ -170,7 +425,7 @@ Instructions:
 . Use the exact tool name from the list above
 . Keep queries simple and clear
 . Use tools according to the type of information needed
-. In case of research paper only use ArXiv and Pubmed
+. In case of research paper only use ResearchPapers, ArXiv or PubMed
 . Summarize information from multiple sources when relevant
 . Stop as soon as you have a clear answer with reference links
 
@@ -178,7 +433,7 @@ Use this exact format:
 
 Question: the input question you must answer
 Thought: analyze the question and decide which tool to use
-Action: use EXACTLY one of these tools: Wikipedia, DuckDuckGo, BasicMath, ArXiv, or PubMed
+Action: use EXACTLY one of these tools: Wikipedia, DuckDuckGo, BasicMath, ArXiv, PubMed, or ResearchPapers
 Action Input: just the plain search query or math expression
 Observation: the result of the action
 ... (this Thought/Action/Action Input/Observation can repeat up to 3 times if needed)
@@ -195,39 +450,171 @@ References:
 Begin!
 
 Question: {{input}}
-Thought:"""
-
-# Initialize the agent
-agent = initialize_agent(
-    tools,
-    llama,
-    agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-    verbose=True,
-    agent_kwargs={
-        "prefix": CUSTOM_PROMPT,
-        "max_iterations": 3,
-        "early_stopping_method": "generate",
-
-    },
-    handle_parsing_errors=True
-)
+Thought:{{agent_scratchpad}}"""
+
+# Parsed once at import with tool_descriptions already baked into the text, so
+# each /search only formats the {input} and {agent_scratchpad} slots. Both slots
+# must stay at the very end: everything before them is byte-identical across
+# requests, which is what lets vLLM's prefix cache reuse its KV blocks.
+AGENT_PROMPT = PromptTemplate.from_template(CUSTOM_PROMPT)
+
+
+class ResearchAgent(ZeroShotAgent):
+    """ZeroShotAgent whose steps run on a tightly capped ``llm_chain``.
+
+    ``llm_chain`` must be built with ``return_final_only=False`` so the finish
+    reason is visible. When a step writes a Final Answer and stops on the token
+    cap, the partial output is appended to the scratchpad and continued on
+    ``final_llm_chain``, which holds the rest of the bin's budget. This is a
+    continuation rather than a regeneration, so streamed tokens are never
+    repeated.
+    """
+
+    final_llm_chain: Optional[LLMChain] = None
 
-@app.route('/')
-def home():
-    return render_template('index.html', tools=tools)
+    def _needs_continuation(self, outputs: Dict) -> bool:
+        if self.final_llm_chain is None or FINAL_ANSWER_ACTION not in outputs['text']:
+            return False
+        generation_info = outputs['full_generation'][0].generation_info or {}
+        return generation_info.get('finish_reason') == 'length'
 
-@app.route('/search', methods=['POST'])
-def search():
+    @staticmethod
+    def _continuation_inputs(full_inputs: Dict, partial_output: str) -> Dict:
+        return {**full_inputs, 'agent_scratchpad': full_inputs['agent_scratchpad'] + partial_output}
+
+    def plan(self, intermediate_steps, callbacks=None, **kwargs):
+        full_inputs = self.get_full_inputs(intermediate_steps, **kwargs)
+        outputs = self.llm_chain.invoke(full_inputs, config={'callbacks': callbacks})
+        full_output = outputs['text']
+        if self._needs_continuation(outputs):
+            full_output += self.final_llm_chain.predict(
+                callbacks=callbacks, **self._continuation_inputs(full_inputs, full_output)
+            )
+        return self.output_parser.parse(full_output)
+
+    async def aplan(self, intermediate_steps, callbacks=None, **kwargs):
+        full_inputs = self.get_full_inputs(intermediate_steps, **kwargs)
+        outputs = await self.llm_chain.ainvoke(full_inputs, config={'callbacks': callbacks})
+        full_output = outputs['text']
+        if self._needs_continuation(outputs):
+            full_output += await self.final_llm_chain.apredict(
+                callbacks=callbacks, **self._continuation_inputs(full_inputs, full_output)
+            )
+        return await self.output_parser.aparse(full_output)
+
+
+def build_agent(bin_name: str) -> AgentExecutor:
+    max_tokens = LLM_BINS[bin_name]
+    step_max_tokens = min(LLM_STEP_MAX_TOKENS, max_tokens)
+    final_llm_chain = None
+    if max_tokens > step_max_tokens:
+        final_llm_chain = LLMChain(llm=make_llm(bin_name, max_tokens - step_max_tokens), prompt=AGENT_PROMPT)
+    return AgentExecutor.from_agent_and_tools(
+        agent=ResearchAgent(
+            llm_chain=LLMChain(
+                llm=make_llm(bin_name, step_max_tokens), prompt=AGENT_PROMPT, return_final_only=False
+            ),
+            allowed_tools=[tool.name for tool in tools],
+            final_llm_chain=final_llm_chain,
+        ),
+        tools=tools,
+        verbose=True,
+        max_iterations=3,
+        early_stopping_method="force",
+        handle_parsing_errors=True
+    )
+
+# Initialize one agent per length bin
+agents = {name: build_agent(name) for name in LLM_BINS}
+
+@app.get('/')
+async def home(request: Request):
+    return templates.TemplateResponse(request, 'index.html', {'tools': tools})
+
+async def read_query(request: Request) -> str:
+    """Return the 'query' string from a JSON request body, or raise ValueError"""
     try:
-        user_input = request.json.get('query')
-        if not user_input:
-            return jsonify({'error': 'No query provided'}), 400
+        body = await request.json()
+    except ValueError:
+        raise ValueError('Request body must be a JSON object')
+    if not isinstance(body, dict):
+        raise ValueError('Request body must be a JSON object')
+    query = body.get('query')
+    if query is not None and not isinstance(query, str):
+        raise ValueError('Query must be a string')
+    if not query or not query.strip():
+        raise ValueError('No query provided')
+    return query
+
+class SearchResult(BaseModel):
+    result: str
+
+# Declaring the response model lets FastAPI serialize the result straight to
+# UTF-8 JSON bytes in pydantic-core, without escaping non-ASCII text.
+@app.post('/search', response_model=SearchResult)
+async def search(request: Request):
+    try:
+        user_input = await read_query(request)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    
+    try:
+        answer = math_fast_path(user_input)
+        if answer is not None:
+            return SearchResult(result=answer)
         
-        result = agent.run(user_input)
-        return jsonify({'result': result})
+        result = await agents[classify_query(user_input)].arun(user_input)
+        return SearchResult(result=result)
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+def sse_event(data, event: Optional[str] = None) -> str:
+    """Format one Server-Sent Event; data is JSON-encoded so newlines stay inside the event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {orjson.dumps(data).decode()}\n\n"
+
+async def stream_answer(user_input: str):
+    """Yield the agent's Final Answer tokens as SSE events while the agent runs"""
+    answer = math_fast_path(user_input)
+    if answer is not None:
+        yield sse_event(answer)
+        yield sse_event(None, event="done")
+        return
+    
+    callback = AsyncFinalIteratorCallbackHandler()
+    agent = agents[classify_query(user_input)]
+    task = asyncio.create_task(agent.arun(user_input, callbacks=[callback]))
+    # The handler only finishes on its own once "Final Answer:" was seen.
+    task.add_done_callback(lambda _: callback.done.set())
+    streamed = ""
+    try:
+        async for token in callback.aiter():
+            streamed += token
+            yield sse_event(token)
+        result = await task
+        # The handler stops after the first LLM call, so the tail of an answer
+        # that was continued past the step cap (or the whole answer, if no
+        # "Final Answer:" prefix was streamed) is sent here.
+        sent = streamed.strip()
+        if not sent:
+            yield sse_event(result)
+        elif result.startswith(sent) and len(result) > len(sent):
+            yield sse_event(result[len(sent):])
+        yield sse_event(None, event="done")
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        yield sse_event(str(e), event="error")
+    finally:
+        task.cancel()
+
+@app.post('/search/stream')
+async def search_stream(request: Request):
+    try:
+        user_input = await read_query(request)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    return StreamingResponse(stream_answer(user_input), media_type='text/event-stream')
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    import uvicorn
+    uvicorn.run('app:app', host='127.0.0.1', port=8000, workers=os.cpu_count(), loop='uvloop', http='httptools')